@@ -0,0 +1,27 @@
+# ---------- One-time int8 ONNX export for the emotion model ----------
+# Exports j-hartmann/emotion-english-distilroberta-base to ONNX and applies
+# dynamic int8 quantization, writing the result to ./emotion-int8.
+# app.py prefers that directory at startup and falls back to FP32 if missing.
+#
+# Run once (needs `pip install optimum[onnxruntime]`):
+#   python quantize_emotion_model.py
+
+from optimum.onnxruntime import ORTModelForSequenceClassification, ORTQuantizer
+from optimum.onnxruntime.configuration import AutoQuantizationConfig
+from transformers import AutoTokenizer
+
+MODEL_NAME = "j-hartmann/emotion-english-distilroberta-base"
+SAVE_DIR = "./emotion-int8"
+
+if __name__ == "__main__":
+    print(f"Exporting {MODEL_NAME} to ONNX...")
+    model = ORTModelForSequenceClassification.from_pretrained(MODEL_NAME, export=True)
+
+    print("Applying dynamic int8 quantization...")
+    quantizer = ORTQuantizer.from_pretrained(model)
+    quantizer.quantize(
+        save_dir=SAVE_DIR,
+        quantization_config=AutoQuantizationConfig.avx512_vnni(is_static=False),
+    )
+    AutoTokenizer.from_pretrained(MODEL_NAME).save_pretrained(SAVE_DIR)
+    print(f"✅ int8 model saved to {SAVE_DIR}")
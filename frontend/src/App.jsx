@@ -143,7 +143,7 @@ function App() {
     if (!chatInput.trim()) return;
     try {
       const res = await axios.post(`${API_BASE}/chatbot`, { message: chatInput });
-      setChatResponse(res.data.reply);
+      setChatResponse(res.data);
     } catch {
       setChatResponse(" Offline: Express how you feel — I’m listening.");
     }